@@ -1,9 +1,13 @@
 from pynput import mouse, keyboard
 import os
-from dataclasses import dataclass
-from threading import Thread
-import psycopg2
-import time
+from contextlib import contextmanager
+from threading import Thread, Lock, Event
+from queue import Queue, Full
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from array import array
+from operator import itemgetter
+from weakref import WeakSet
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -33,107 +37,149 @@ REGULAR_KEYS = {
 }
 
 MOUSE_BUTTONS = {'mouse_left', 'mouse_right', 'mouse_middle'}
-ALL_INPUTS = SPECIAL_KEYS.union(REGULAR_KEYS).union(MOUSE_BUTTONS)
+ALL_INPUTS = frozenset(SPECIAL_KEYS | REGULAR_KEYS | MOUSE_BUTTONS)
+
+# Counters live in a flat array indexed by a stable per-input id
+KEY_LIST = sorted(ALL_INPUTS)
+KEY_ID = {input_name: i for i, input_name in enumerate(KEY_LIST)}
+MOUSE_LEFT_ID = KEY_ID['mouse_left']
+MOUSE_RIGHT_ID = KEY_ID['mouse_right']
+MOUSE_MIDDLE_ID = KEY_ID['mouse_middle']
+MOUSE_IDS = frozenset({MOUSE_LEFT_ID, MOUSE_RIGHT_ID, MOUSE_MIDDLE_ID})
 
 # --- Data Class ---
-@dataclass
 class Metrics:
-  input_counts: dict = None
-  last_updated: str = None
+  __slots__ = ('input_counts', 'last_updated')
+  
+  def __init__(self, input_counts: array = None, last_updated: datetime = None):
+    self.input_counts = input_counts
+    self.last_updated = last_updated
   
   def __str__(self):
       mouse_stats = (
           f'Mouse Clicks - '
-          f'L: [{self.input_counts.get("mouse_left", 0)}] '
-          f'R: [{self.input_counts.get("mouse_right", 0)}] '
-          f'M: [{self.input_counts.get("mouse_middle", 0)}]'
+          f'L: [{self.input_counts[MOUSE_LEFT_ID]}] '
+          f'R: [{self.input_counts[MOUSE_RIGHT_ID]}] '
+          f'M: [{self.input_counts[MOUSE_MIDDLE_ID]}]'
       )
-      key_stats = f'Total key presses: {sum(count for key, count in self.input_counts.items() if not key.startswith("mouse_"))}'
+      key_stats = f'Total key presses: {sum(count for i, count in enumerate(self.input_counts) if i not in MOUSE_IDS)}'
       return f'{mouse_stats}\n{key_stats}\nLast updated: {self.last_updated}'
+  
+  def print_current_counts(self):
+    print("\nCurrent Input Counts:")
+    pressed = [item for item in zip(KEY_LIST, self.input_counts) if item[1] > 0]
+    for input_name, count in sorted(pressed, key=itemgetter(1), reverse=True):
+      print(f"Input: {input_name}, Count: {count}")
     
 class Database:
   def __init__(self):
-    self.conn = None
-    self.cur = None
+    self.pool = ThreadedConnectionPool(1, 4, os.getenv('DATABASE_URL'))
+    self._prepared = WeakSet()
     
-  def connect(self):
-    self.conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    self.cur = self.conn.cursor()
-    
-  def disconnect(self):
-    if self.cur:
-      self.cur.close()
-    if self.conn:
-      self.conn.close()
+  @contextmanager
+  def _cursor(self):
+    conn = self.pool.getconn()
+    try:
+      with conn.cursor() as cur:
+        yield cur
+      conn.commit()
+    except Exception:
+      # A dropped connection is already closed; rolling it back would mask
+      # the original error
+      if not conn.closed:
+        conn.rollback()
+      raise
+    finally:
+      self.pool.putconn(conn)
       
+  def close(self):
+    self.pool.closeall()
+    
   def setup_database(self):
-    self.connect()
-    self.cur.execute(
-      """
-        CREATE TABLE IF NOT EXISTS key_presses (
-            input_name TEXT PRIMARY KEY,
-            press_count INTEGER DEFAULT 0,
-            last_updated TIMESTAMP
-        );
-      """
-    )    
-    self.conn.commit()
+    with self._cursor() as cur:
+      cur.execute(
+        """
+          CREATE TABLE IF NOT EXISTS key_presses (
+              input_name TEXT PRIMARY KEY,
+              press_count INTEGER DEFAULT 0,
+              last_updated TIMESTAMP
+          );
+        """
+      )
 
   def load_data(self):
-    self.connect()
-    self.cur.execute("SELECT input_name, press_count FROM key_presses")
-    data= {row[0]: row[1] for row in self.cur.fetchall()}
-    self.disconnect()
+    with self._cursor() as cur:
+      cur.execute("SELECT input_name, press_count FROM key_presses")
+      data = {row[0]: row[1] for row in cur.fetchall()}
     return data
   
-  def save_data(self, data: Metrics):
-    self.connect()
-    data.last_updated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+  def save_data(self, data: Metrics, dirty):
+    if not dirty:
+      return
+    data.last_updated = datetime.now().replace(microsecond=0)
 
-    for input_name, press_count in data.input_counts.items():
-      self.cur.execute("""
-          INSERT INTO key_presses (input_name, press_count, last_updated)
-          VALUES (%s, %s, %s)
-          ON CONFLICT (input_name) DO UPDATE 
-          SET 
-              press_count = EXCLUDED.press_count,
-              last_updated = EXCLUDED.last_updated
-      """, (input_name, press_count, data.last_updated))
-      
-    self.conn.commit()
-    self._print_current_counts()
-
-    self.disconnect()  
+    input_names = [KEY_LIST[i] for i in dirty]
+    press_counts = [data.input_counts[i] for i in dirty]
+    with self._cursor() as cur:
+      self._prepare_upsert(cur)
+      cur.execute(
+        "EXECUTE upsert_key_presses(%s, %s, %s)",
+        (input_names, press_counts, data.last_updated)
+      )
+    
+  def _prepare_upsert(self, cur):
+    # Prepared statements live per session, so each pooled connection
+    # prepares the upsert once and reuses the plan on every later save
+    if cur.connection in self._prepared:
+      return
+    cur.execute(
+      """
+        PREPARE upsert_key_presses(TEXT[], INTEGER[], TIMESTAMP) AS
+        INSERT INTO key_presses (input_name, press_count, last_updated)
+        SELECT input_name, press_count, $3
+        FROM unnest($1, $2) AS t(input_name, press_count)
+        ON CONFLICT (input_name) DO UPDATE 
+        SET 
+            press_count = EXCLUDED.press_count,
+            last_updated = EXCLUDED.last_updated
+      """
+    )
+    self._prepared.add(cur.connection)
     
   def _initialize_inputs(self):
-    for id in ALL_INPUTS:
-      self.cur.execute(
+    with self._cursor() as cur:
+      execute_values(
+        cur,
         """
           INSERT INTO key_presses (input_name, press_count, last_updated)
-          VALUES (%s, 0, NOW())
+          VALUES %s
           ON CONFLICT (input_name) DO NOTHING
-        """, (id,)
+        """,
+        [(id,) for id in ALL_INPUTS],
+        template="(%s, 0, NOW())",
+        page_size=200
       )
-    self.conn.commit()
-    
-  def _print_current_counts(self):
-    self.cur.execute("""
-        SELECT input_name, press_count, last_updated 
-        FROM key_presses 
-        WHERE press_count > 0
-        ORDER BY press_count DESC
-    """)
-    print("\nCurrent Input Counts:")
-    for row in self.cur.fetchall():
-        print(f"Input: {row[0]}, Count: {row[1]}, Last Updated: {row[2]}")
 
 
 # --- Main ---
 def main():
   metrics = Metrics()
-  metrics.input_counts = {key: 0 for key in ALL_INPUTS}
+  metrics.input_counts = array('Q', [0] * len(KEY_LIST))
+  input_counts = metrics.input_counts  # local alias for the listener callbacks
   db = Database()
   save_interval = 5  # seconds
+  shutdown_timeout = 10  # seconds
+  verbose = bool(os.getenv('DEBUG'))
+  dirty = set()
+  dirty_lock = Lock()
+  key_cache = {}
+  stop = Event()
+  save_queue = Queue(maxsize=4)  # dirty snapshots waiting to be written
+  button_ids = {
+    mouse.Button.left: MOUSE_LEFT_ID,
+    mouse.Button.right: MOUSE_RIGHT_ID,
+    mouse.Button.middle: MOUSE_MIDDLE_ID,
+  }
   
   # Setup database
   db.setup_database()
@@ -141,47 +187,122 @@ def main():
   
   # Load previous data
   previous_data = db.load_data()
-  metrics.input_counts.update(previous_data)
+  for input_name, press_count in previous_data.items():
+    input_id = KEY_ID.get(input_name)
+    if input_id is not None:
+      input_counts[input_id] = press_count
   
-  # Save metrics every interval
-  def save_metrics():
+  # Swap out the inputs touched since the last save
+  def drain_dirty():
+    nonlocal dirty
+    with dirty_lock:
+      snapshot, dirty = dirty, set()
+    return snapshot
+  
+  # Put a snapshot back so its inputs go out with the next save
+  def restore_dirty(snapshot):
+    with dirty_lock:
+      dirty.update(snapshot)
+  
+  # Write queued snapshots; all database I/O happens on this thread
+  def write_metrics():
     while True:
-      time.sleep(save_interval)
-      db.save_data(metrics)  
+      snapshot = save_queue.get()
+      if snapshot is None:
+        break
+      try:
+        db.save_data(metrics, snapshot)
+      except Exception as e:
+        print(f'Failed to save metrics: {e}')
+        restore_dirty(snapshot)
+        continue
+      if verbose:
+        metrics.print_current_counts()
+  
+  # Queue a snapshot every interval until asked to stop; if the writer is
+  # backed up, keep the inputs dirty for the next interval instead of blocking
+  def save_metrics():
+    while not stop.wait(save_interval):
+      snapshot = drain_dirty()
+      if snapshot:
+        try:
+          save_queue.put_nowait(snapshot)
+        except Full:
+          restore_dirty(snapshot)
       
+  write_thread = Thread(target=write_metrics)
+  write_thread.daemon = True
+  write_thread.start()
   save_thread = Thread(target=save_metrics)
   save_thread.daemon = True
   save_thread.start()
   
   # Start tracking inputs
   def on_press(key):
-    key_str = key.char if hasattr(key, 'char') else str(key).replace('Key.', '')
-    if key_str in metrics.input_counts:
-      metrics.input_counts[key_str] += 1
+    input_id = key_cache.get(key)
+    if input_id is None:
+      # KeyCodes carry a char (None for vk-only codes), Key members a name
+      key_str = getattr(key, 'char', None)
+      if key_str is None:
+        key_str = getattr(key, 'name', None)
+      input_id = KEY_ID.get(key_str)
+      if input_id is not None:
+        key_cache[key] = input_id
+    if input_id is not None:
+      with dirty_lock:
+        input_counts[input_id] += 1
+        dirty.add(input_id)
     else:
       print(f'Unknown key: {key_str}')
       
     if key == keyboard.Key.esc:
       print("Stopping program...")
-      print("Total metrics for the current session: ", metrics)
-      # Save final metrics before exiting
-      db.save_data(metrics)
-      os._exit(0)
-
+      stop.set()
+      mouse_listener.stop()
+      return False
       
   def on_click(x, y, button, pressed):
-    if pressed:
-      if button == mouse.Button.left:
-        metrics.input_counts['mouse_left'] += 1
-      elif button == mouse.Button.right:
-        metrics.input_counts['mouse_right'] += 1
-      elif button == mouse.Button.middle:
-        metrics.input_counts['mouse_middle'] += 1
+    if not pressed:
+      return
+    input_id = button_ids.get(button)
+    if input_id is not None:
+      with dirty_lock:
+        input_counts[input_id] += 1
+        dirty.add(input_id)
       
   with mouse.Listener(on_click=on_click) as mouse_listener:
     with keyboard.Listener(on_press=on_press) as key_listener:
       mouse_listener.join()
       key_listener.join()
+  
+  # The interval thread never blocks, so it exits as soon as stop is set;
+  # joining it first keeps its last snapshot ahead of the sentinel
+  save_thread.join()
+  print("Total metrics for the current session: ", metrics)
+  
+  # Queue the final snapshot and wait for the writer, but never hang on it
+  snapshot = drain_dirty()
+  try:
+    if snapshot:
+      save_queue.put(snapshot, timeout=shutdown_timeout)
+    save_queue.put(None, timeout=shutdown_timeout)
+  except Full:
+    pass
+  else:
+    write_thread.join(timeout=shutdown_timeout)
+    
+  # A writer stuck in a query holds its connection's lock, so closing the
+  # pool would block just as long; exit without touching it instead
+  if write_thread.is_alive():
+    print("Database writer is stuck; exiting without the final save", flush=True)
+    os._exit(1)
+  
+  # The listeners are stopped, so anything dirty now was put back by a save
+  # that failed during shutdown
+  unsaved = drain_dirty()
+  if unsaved:
+    print(f"Final save failed; exiting without saving {len(unsaved)} inputs")
+  db.close()
 
 if __name__ == '__main__':
   main()
\ No newline at end of file